@@ -1,179 +1,521 @@
 import os
+import sys
+import sysconfig
 import time
+import json
+import hashlib
+import atexit
 import argparse
-import requests
+import threading
+import queue
+import httpx
 import shutil
-import base64  # Added for decoding PDF data
-from bs4 import BeautifulSoup
+import subprocess
+try:
+    import pybase64 as base64  # SIMD-accelerated decoder when available
+except ImportError:
+    import base64  # Added for decoding PDF data
+from bs4 import BeautifulSoup, SoupStrainer
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 from urllib.parse import urljoin
-from pypdf import PdfWriter
-from concurrent.futures import ThreadPoolExecutor
+from pypdf import PdfReader, PdfWriter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Prefer the C-backed lxml parser, fall back to the stdlib one
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# HTTP/2 needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# pikepdf (qpdf bindings) recompresses each page PDF when installed
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Webpage scraper and PDF generator")
 parser.add_argument("url", type=str, help="Website URL to scrape")
-parser.add_argument("--threads", type=int, default=5, help="Number of threads (default: 5)")
+parser.add_argument("--threads", type=int, default=None, help="Number of threads (default: 5, or one per CPU without the GIL)")
+parser.add_argument("--text-only", action="store_true", help="Skip downloading fonts and video while rendering")
+parser.add_argument("--dump-links", action="store_true", help="Also save the discovered links to website_links.txt")
+parser.add_argument("--no-cache", action="store_true", help="Always re-render pages instead of reusing cached PDFs")
 args = parser.parse_args()
 
 # Website URL from command-line
 url = args.url
-num_threads = args.threads  # Number of threads for parallel processing
+
+# Free-threaded builds (python3.13t) can run one worker per core without GIL contention
+free_threaded = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+gil_enabled = sys._is_gil_enabled() if free_threaded else True
+if free_threaded and gil_enabled:
+    print("⚠️ Free-threaded Python is running with the GIL enabled; set PYTHON_GIL=0 to disable it")
+
+# Number of threads for parallel processing
+if args.threads:
+    num_threads = args.threads
+elif not gil_enabled:
+    num_threads = os.cpu_count() or 5
+else:
+    num_threads = 5
 
 # Set headers to mimic a browser
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 }
 
+# Shared HTTP client with connection reuse and retries on connect errors
+http_client = httpx.Client(
+    headers=headers,
+    timeout=15,
+    follow_redirects=True,
+    transport=httpx.HTTPTransport(http2=HTTP2, retries=3),
+)
+atexit.register(http_client.close)
+
+# Cache probes get their own client: a short timeout and no retries, so an
+# unreachable host costs a few seconds rather than a render's worth
+probe_client = httpx.Client(headers=headers, timeout=3, follow_redirects=True)
+atexit.register(probe_client.close)
+
+# Configure Chrome in headless mode
+chrome_options = Options()
+chrome_options.add_argument("--headless=new")
+chrome_options.add_argument("--disable-gpu")
+# Trim per-instance memory and startup work
+for flag in (
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--no-first-run",
+    "--disable-translate",
+    "--hide-scrollbars",
+    "--disk-cache-size=0",
+    "--window-size=1280,1696",
+):
+    chrome_options.add_argument(flag)
+# Return from driver.get() at DOMContentLoaded; process_page waits for networkIdle before scrolling
+chrome_options.page_load_strategy = "eager"
+# Expose CDP page (lifecycle) and network events through the performance log
+chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": True})
+
+# Page.printToPDF settings; also part of the cache key
+PDF_OPTIONS = {
+    "printBackground": True,
+    "transferMode": "ReturnAsStream",
+    "preferCSSPageSize": True, # Use the page’s CSS-defined size
+    "scale": 1.0,
+    # The merged output needs no outline or structure tree
+    "generateDocumentOutline": False,
+    "generateTaggedPDF": False
+}
+
+# Resources skipped in --text-only mode (images stay, since backgrounds are printed)
+# Trailing wildcards also match versioned URLs such as "fa.woff2?v=4.7.0"
+BLOCKED_RESOURCES = ["*.woff*", "*.ttf*", "*.otf*", "*.eot*", "*.mp4*", "*.webm*"]
+
+# One WebDriver per worker thread, reused for every page that thread handles
+thread_local = threading.local()
+drivers = []
+drivers_lock = threading.Lock()
+
+def get_driver():
+    """Returns the current thread's WebDriver, starting it on first use."""
+    driver = getattr(thread_local, "driver", None)
+    if driver is None:
+        driver = webdriver.Chrome(options=chrome_options)
+        # driver = uc.Chrome(headless=True)
+        thread_local.driver = driver
+        with drivers_lock:
+            drivers.append(driver)
+        try:
+            driver.execute_cdp_cmd("Page.setLifecycleEventsEnabled", {"enabled": True})
+            if args.text_only:
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_RESOURCES})
+        except Exception:
+            drop_driver()
+            raise
+    return driver
+
+def drop_driver():
+    """Quits the current thread's WebDriver so the next page starts a fresh one."""
+    driver = getattr(thread_local, "driver", None)
+    thread_local.driver = None
+    if driver is None:
+        return
+    with drivers_lock:
+        if driver in drivers:
+            drivers.remove(driver)
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def init_worker():
+    """Starts Chrome as soon as a worker thread is spawned."""
+    try:
+        get_driver()
+    except Exception as e:
+        print(f"⚠️ Failed to start Chrome in worker: {e}")
+
+def quit_drivers():
+    """Shuts down every WebDriver started by the worker threads."""
+    with drivers_lock:
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        drivers.clear()
+
+atexit.register(quit_drivers)
+
+def wait_for_network_idle(driver, timeout=10):
+    """Waits for Chrome's networkIdle lifecycle event on the top frame."""
+    # Match the current document too: the frame id survives navigations on a
+    # reused driver, so a late event from the previous page must not count
+    frame = driver.execute_cdp_cmd("Page.getFrameTree", {})['frameTree']['frame']
+    frame_id, loader_id = frame['id'], frame['loaderId']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry['message'])['message']
+            params = message.get('params', {})
+            if (message.get('method') == "Page.lifecycleEvent"
+                    and params.get('name') == "networkIdle"
+                    and params.get('frameId') == frame_id
+                    and params.get('loaderId') == loader_id):
+                return True
+        time.sleep(0.1)
+    return False
+
+def wait_for_requests_settled(driver, quiet=0.5, timeout=5):
+    """Waits until requests seen since the last log drain finish and the network stays quiet."""
+    in_flight = set()
+    last_activity = time.monotonic()
+    deadline = last_activity + timeout
+    while time.monotonic() < deadline:
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry['message'])['message']
+            method = message.get('method')
+            request_id = message.get('params', {}).get('requestId')
+            if method == "Network.requestWillBeSent":
+                in_flight.add(request_id)
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                in_flight.discard(request_id)
+            else:
+                continue
+            last_activity = time.monotonic()
+        if not in_flight and time.monotonic() - last_activity >= quiet:
+            return True
+        time.sleep(0.1)
+    return False
+
+def save_pdf_stream(driver, handle, pdf_file, chunk_size=65536):
+    """Copies a CDP IO stream to disk chunk by chunk, then closes the stream."""
+    try:
+        with open(pdf_file, 'wb') as f:
+            while True:
+                chunk = driver.execute_cdp_cmd("IO.read", {"handle": handle, "size": chunk_size})
+                data = chunk.get('data', '')
+                if chunk.get('base64Encoded'):
+                    f.write(base64.b64decode(data))
+                else:
+                    f.write(data.encode('utf-8'))
+                if chunk.get('eof'):
+                    break
+    finally:
+        driver.execute_cdp_cmd("IO.close", {"handle": handle})
+
+def absolute_url(href):
+    """Resolves a link against the base URL, skipping urljoin for absolute links."""
+    return href if href.startswith(("http://", "https://")) else urljoin(url, href)
+
+# Start the worker pool now so Chrome boots while the homepage is fetched
+executor = ThreadPoolExecutor(max_workers=num_threads, initializer=init_worker)
+for _ in range(num_threads):
+    executor.submit(lambda: None)
+
 # Fetch the webpage
 try:
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url)
     response.raise_for_status()
     print("✅ Website fetched successfully!")
 
     # Parse the HTML
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(response.text, HTML_PARSER, parse_only=SoupStrainer("a", href=True))
 
-    # Extract unique absolute URLs
-    links = {urljoin(url, a['href']) for a in soup.find_all('a', href=True)}
+    # Extract unique absolute URLs in sorted order
+    links = sorted({absolute_url(a['href']) for a in soup.find_all('a', href=True)})
 
     if not links:
-        print("❌ No links found. Exiting.")
-        exit()
+        print("❌ No links found.")
 
-    # Save links to a text file in sorted order
-    text_file = "website_links.txt"
-    with open(text_file, "w", encoding="utf-8") as file:
-        file.write("\n".join(sorted(links)))
+    # Save links to a text file only when asked for
+    if args.dump_links:
+        text_file = "website_links.txt"
+        with open(text_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(links))
 
-    print(f"🔗 Links saved to '{text_file}'")
+        print(f"🔗 Links saved to '{text_file}'")
 
-except requests.exceptions.RequestException as e:
+except httpx.HTTPError as e:
     print(f"❌ Error fetching website: {e}")
     exit()
 
-# Read links from the text file into a sorted list
-with open(text_file, "r", encoding="utf-8") as file:
-    links = [line.strip() for line in file.readlines() if line.strip()]
-
-print(f"📄 Extracted {len(links)} links from '{text_file}'.")
+print(f"📄 Extracted {len(links)} links.")
 
-# Folder for PDFs
+# Folder for PDFs, only needed when there is something to render
 pdf_folder = "pdf_pages"
-os.makedirs(pdf_folder, exist_ok=True)
+if links:
+    os.makedirs(pdf_folder, exist_ok=True)
+else:
+    # Nothing to render: stop the pre-warmed browsers right away
+    executor.shutdown(cancel_futures=True)
+    quit_drivers()
+
+# Function to shrink a page PDF in place before it is cached and merged
+def compress_pdf(pdf_file):
+    """Rewrites a PDF with compressed streams and object streams, if pikepdf is available."""
+    if pikepdf is None:
+        return
+    try:
+        with pikepdf.open(pdf_file, allow_overwriting_input=True) as pdf:
+            pdf.save(
+                pdf_file,
+                compress_streams=True,
+                stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                linearize=False,
+            )
+    except Exception as e:
+        print(f"⚠️ Failed to compress {pdf_file}: {e}")
 
-# Configure Chrome in headless mode
-chrome_options = Options()
-chrome_options.add_argument("--headless=new")
-chrome_options.add_argument("--disable-gpu")
+# Cache of rendered PDFs, keyed by URL + ETag/Last-Modified
+cache_dir = ".pdf_cache"
+if links and not args.no_cache:
+    os.makedirs(cache_dir, exist_ok=True)
+
+def cache_key(link):
+    """Returns the cache key for a page, or None if it can't be validated."""
+    try:
+        head = probe_client.head(link)
+    except httpx.HTTPError:
+        return None
+    # Validators on error responses (404, 5xx) say nothing about the page
+    if not head.is_success:
+        return None
+    validator = head.headers.get('etag') or head.headers.get('last-modified')
+    if not validator:
+        return None
+    # Tag entries with this script and its render settings, since webtext.py
+    # shares the cache directory but renders pages differently
+    mode = "text-only" if args.text_only else "full"
+    settings = json.dumps(PDF_OPTIONS, sort_keys=True)
+    raw_key = f"webscraper_api\n{link}\n{validator}\n{mode}\n{settings}"
+    return hashlib.sha256(raw_key.encode()).hexdigest()[:32]
+
+def store_in_cache(pdf_file, key):
+    """Copies a rendered PDF into the cache, replacing any older entry atomically."""
+    cached_file = os.path.join(cache_dir, f"{key}.pdf")
+    tmp_file = f"{cached_file}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(pdf_file, tmp_file)
+        os.replace(tmp_file, cached_file)
+    except OSError as e:
+        print(f"⚠️ Failed to cache {pdf_file}: {e}")
 
 # Function to process each webpage and save as PDF
 def process_page(index, link):
-    """Processes a single webpage and saves it as a PDF."""
+    """Processes a single webpage and returns (index, pdf_file), with None on failure."""
     pdf_file = os.path.join(pdf_folder, f"page_{index}.pdf")
 
     try:
         print(f"📄 Processing ({index}/{len(links)}): {link}")
 
-        # Start a new WebDriver instance
-        driver = webdriver.Chrome(options=chrome_options)
-        # driver = uc.Chrome(headless=True)
+        # Reuse an earlier render if the page hasn't changed
+        key = None if args.no_cache else cache_key(link)
+        if key:
+            cached_file = os.path.join(cache_dir, f"{key}.pdf")
+            if os.path.exists(cached_file):
+                shutil.copyfile(cached_file, pdf_file)
+                print(f"♻️ Cached PDF reused: {pdf_file}")
+                return index, pdf_file
+
+        # Reuse this thread's WebDriver instance
+        driver = get_driver()
+        driver.get_log("performance")  # Drop events left over from the previous page
         driver.get(link)
 
-        # Wait until page fully loads
+        # Let the page finish loading, trigger lazy-loaded content, then
+        # wait for the requests the scroll started (networkIdle fires only once)
         try:
-            WebDriverWait(driver, 10).until(
-                lambda driver: driver.execute_script("return document.readyState") == "complete"
-            )
-            time.sleep(2)  # Extra buffer for lazy-loaded content
+            if not wait_for_network_idle(driver):
+                print(f"⚠️ Network never went idle, scrolling anyway: {link}")
 
+            driver.get_log("performance")
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(1)
+            if not wait_for_requests_settled(driver):
+                print(f"⚠️ Lazy-loaded requests still pending, printing anyway: {link}")
 
         except Exception as e:
             print(f"⚠️ Timeout waiting for page to load: {link} - {e}")
-            driver.quit()
-            return None
+            return index, None
 
         # Use Chrome DevTools Protocol to print to PDF
         try:
-            pdf_data = driver.execute_cdp_cmd("Page.printToPDF", {
-                "printBackground": True,
-                "transferMode": "ReturnAsBase64",
-                "preferCSSPageSize": True, # Use the page’s CSS-defined size
-                "scale": 1.0
-            })
+            pdf_data = driver.execute_cdp_cmd("Page.printToPDF", PDF_OPTIONS)
         except Exception as e:
             print(f"❌ Failed to generate PDF for {link}: {e}")
-            driver.quit()
-            return None
+            return index, None
 
-        # Decode and save the PDF content
+        # Stream the PDF content straight to disk
         try:
-            pdf_content = base64.b64decode(pdf_data['data'])
-            with open(pdf_file, 'wb') as f:
-                f.write(pdf_content)
+            save_pdf_stream(driver, pdf_data['stream'], pdf_file)
         except Exception as e:
             print(f"❌ Failed to save PDF for {link}: {e}")
-            driver.quit()
-            return None
+            return index, None
 
         # Verify PDF was saved
         if os.path.exists(pdf_file) and os.path.getsize(pdf_file) > 0:
             print(f"✅ PDF saved: {pdf_file}")
-            driver.quit()
-            return pdf_file
+            compress_pdf(pdf_file)
+            if key:
+                store_in_cache(pdf_file, key)
+            return index, pdf_file
         else:
             print(f"❌ Empty PDF file for {link}")
-            driver.quit()
-            return None
+            return index, None
 
     except Exception as e:
         print(f"❌ Error processing {link}: {e}")
-        return None
+        return index, None
+
+    finally:
+        # Stop any pending loads so the driver is idle for the next page;
+        # if the session itself is gone, replace the driver instead
+        driver = getattr(thread_local, "driver", None)
+        if driver is not None:
+            try:
+                driver.execute_script("window.stop();")
+            except WebDriverException as e:
+                print(f"⚠️ WebDriver session lost, restarting Chrome: {e.msg}")
+                drop_driver()
+
+# Function to merge finished PDFs in page order while other pages still render
+def ordered_merger(results, output_file, status):
+    """Appends PDFs from the results queue to a single writer in index order."""
+    writer = None
+    pending = {}
+    next_index = 1
+    while True:
+        item = results.get()
+        if item is None:
+            break
+        index, pdf = item
+        pending[index] = pdf
+
+        # Append every page that is now contiguous with what was merged so far
+        while next_index in pending:
+            pdf = pending.pop(next_index)
+            next_index += 1
+            if not pdf:
+                continue
+            try:
+                reader = PdfReader(pdf, strict=False)
+                if writer is None:
+                    # Take the first document as-is, then only copy pages from the rest
+                    writer = PdfWriter(clone_from=reader)
+                else:
+                    writer.append_pages_from_reader(reader)
+                reader.stream.close()
+                del reader
+                status["merged"] += 1
+            except Exception as e:
+                print(f"⚠️ Skipping corrupt PDF {pdf}: {e}")
+
+    # Page files are kept until the merged PDF is written, so a failed write loses nothing
+    if writer is not None:
+        try:
+            writer.write(output_file)
+            writer.close()
+        except Exception as e:
+            status["error"] = e
+
+# Function to concatenate PDFs with qpdf when it is installed
+def merge_with_qpdf(pdf_files, output_file):
+    """Merges PDFs in C++ via qpdf, without building page objects in Python."""
+    result = subprocess.run(["qpdf", "--empty", "--pages", *pdf_files, "--", output_file])
+    # Exit code 3 means qpdf succeeded with warnings
+    if result.returncode not in (0, 3):
+        raise subprocess.CalledProcessError(result.returncode, result.args)
+
+# qpdf merges everything at the end; otherwise merge in the background as pages finish
+use_qpdf = shutil.which("qpdf") is not None
+output_file = "merged.pdf"
+merge_queue = queue.Queue()
+merge_status = {"merged": 0, "error": None}
+results = {}
+if not use_qpdf:
+    merger = threading.Thread(target=ordered_merger, args=(merge_queue, output_file, merge_status), daemon=True)
+    merger.start()
 
 # Process all links using multithreading
-pdf_files = []
-with ThreadPoolExecutor(max_workers=num_threads) as executor:
-    # Submit tasks with index and link, preserving order
+with executor:
+    # Each task returns (index, pdf_file); page order is restored when merging
     futures = [executor.submit(process_page, index + 1, link) for index, link in enumerate(links)]
-    for future in futures:
-        result = future.result()
-        if result:
-            pdf_files.append(result)
+    for future in as_completed(futures):
+        index, pdf_file = future.result()
+        if use_qpdf:
+            results[index] = pdf_file
+        else:
+            merge_queue.put((index, pdf_file))
 
-# Get all PDF files sorted by index
-pdf_files = sorted(pdf_files, key=lambda x: int(os.path.splitext(os.path.basename(x))[0].split('_')[1]))
+# Close the browsers before finishing the merge to free their memory
+quit_drivers()
 
-# Merge PDFs if any were generated
-if pdf_files:
+if use_qpdf:
+    pdf_files = [results[index] for index in sorted(results) if results[index]]
     try:
-        writer = PdfWriter()
-        for pdf in pdf_files:
-            writer.append(pdf)
-
-        output_file = "merged.pdf"
-        writer.write(output_file)
-        writer.close()
-
-        print(f"✅ Merged PDF saved as: {output_file}")
-
-        # Cleanup individual PDFs
-        shutil.rmtree(pdf_folder, ignore_errors=True)
-        print(f"🗑️ Deleted folder: {pdf_folder}")
-
-    except Exception as e:
-        print(f"❌ Error merging PDFs: {e}")
+        if pdf_files:
+            merge_with_qpdf(pdf_files, output_file)
+            merge_status["merged"] = len(pdf_files)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        print(f"⚠️ qpdf failed ({e}), merging with pypdf instead")
+        for index in sorted(results):
+            merge_queue.put((index, results[index]))
+        merge_queue.put(None)
+        ordered_merger(merge_queue, output_file, merge_status)
+else:
+    # Let the merger write the final PDF
+    merge_queue.put(None)
+    merger.join()
+
+if merge_status["error"]:
+    print(f"❌ Error merging PDFs: {merge_status['error']}")
+elif merge_status["merged"]:
+    print(f"✅ Merged PDF saved as: {output_file}")
+
+    # Cleanup individual PDFs
+    shutil.rmtree(pdf_folder, ignore_errors=True)
+    print(f"🗑️ Deleted folder: {pdf_folder}")
 else:
     print("❌ No PDFs found to merge.")
 
-# Delete the links file
-if os.path.exists(text_file):
-    os.remove(text_file)
-    print("🗑️ Deleted website_links.txt")
-
 print("\n✅ Process completed!")
\ No newline at end of file
@@ -1,12 +1,23 @@
 import os
+import sys
+import sysconfig
 import time
+import json
+import hashlib
+import atexit
 import argparse
+import threading
+import queue
 import shutil
-import base64
+import subprocess
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 import logging
-import requests
+import httpx
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin, urlparse
 
 from selenium import webdriver
@@ -14,9 +25,31 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pypdf import PdfReader, PdfWriter
+
+# -------------------- OPTIONAL SPEEDUPS --------------------
+# Prefer the C-backed lxml parser, fall back to the stdlib one
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# HTTP/2 in httpx needs the h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
 
-from concurrent.futures import ThreadPoolExecutor
-from pypdf import PdfWriter
+# pikepdf recompresses page PDFs before merging
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
 
 # -------------------- LOGGING --------------------
 logging.basicConfig(
@@ -27,12 +60,26 @@ logging.basicConfig(
 # -------------------- ARGUMENTS --------------------
 parser = argparse.ArgumentParser(description="Web Scraper + PDF Generator")
 parser.add_argument("url", help="Website URL")
-parser.add_argument("--threads", type=int, default=2, help="Max threads (recommended: 2)")
+parser.add_argument("--threads", type=int, default=None, help="Max threads (recommended: 2, default: one per CPU on free-threaded Python)")
+parser.add_argument("--text-only", action="store_true", help="Block images, fonts and video while rendering")
+parser.add_argument("--no-cache", action="store_true", help="Ignore previously rendered PDFs")
 args = parser.parse_args()
 
 BASE_URL = args.url
-MAX_THREADS = args.threads
-BASE_DOMAIN = urlparse(BASE_URL).netloc
+BASE_DOMAIN = urlparse(BASE_URL).netloc.lower()
+
+# -------------------- FREE-THREADING --------------------
+FREE_THREADED = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+GIL_ENABLED = sys._is_gil_enabled() if FREE_THREADED else True
+if FREE_THREADED and GIL_ENABLED:
+    logging.warning("Free-threaded Python is running with the GIL enabled (set PYTHON_GIL=0)")
+
+if args.threads:
+    MAX_THREADS = args.threads
+elif not GIL_ENABLED:
+    MAX_THREADS = os.cpu_count() or 2
+else:
+    MAX_THREADS = 2
 
 # -------------------- BLOCKED SOCIAL DOMAINS --------------------
 BLOCKED_DOMAINS = [
@@ -45,46 +92,291 @@ BLOCKED_DOMAINS = [
     "wa.me",
     "t.me"
 ]
+BLOCKED_SET = frozenset(BLOCKED_DOMAINS)
 
 # -------------------- HELPERS --------------------
+def absolute_url(href: str) -> str:
+    # Most hrefs are already absolute; only relative ones need urljoin
+    return href if href.startswith(("http://", "https://")) else urljoin(BASE_URL, href)
+
 def clean_url(u: str) -> str:
     return u.split("?")[0].rstrip("/")
 
-def same_domain(u: str) -> bool:
-    return urlparse(u).netloc == BASE_DOMAIN
+def is_blocked_host(host: str) -> bool:
+    # Exact domain or any subdomain of it ("m.facebook.com"), never a substring
+    return host in BLOCKED_SET or any(host.endswith("." + b) for b in BLOCKED_SET)
 
 def is_blocked_domain(u: str) -> bool:
-    domain = urlparse(u).netloc.lower()
-    return any(b in domain for b in BLOCKED_DOMAINS)
+    return is_blocked_host(urlparse(u).netloc.lower())
+
+def classify(u: str) -> tuple[bool, bool, bool]:
+    # One parse per URL: (is http(s), same domain, blocked domain)
+    p = urlparse(u)
+    host = p.netloc.lower()
+    return p.scheme.startswith("http"), host == BASE_DOMAIN, is_blocked_host(host)
+
+def is_wanted_link(u: str) -> bool:
+    is_http, is_internal, is_blocked = classify(u)
+    return is_http and is_internal and not is_blocked
+
+# -------------------- SELENIUM SETUP --------------------
+chrome_options = Options()
+chrome_options.add_argument("--headless=new")
+chrome_options.add_argument("--disable-gpu")
+chrome_options.add_argument("--no-sandbox")
+
+# Scraper-tuned flags to cut memory per Chrome instance
+for flag in (
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--no-first-run",
+    "--disable-translate",
+    "--hide-scrollbars",
+    "--disk-cache-size=0",
+    "--window-size=1280,1696",
+):
+    chrome_options.add_argument(flag)
+if args.text_only:
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+
+# driver.get() returns at DOMContentLoaded; network idle is awaited separately
+chrome_options.page_load_strategy = "eager"
+
+# Page lifecycle and network events are read back from the performance log
+chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": True})
+
+# Heavy resources skipped with --text-only; the trailing wildcard also
+# catches query strings ("logo.png?v=3", "fa.woff2?v=4.7.0")
+BLOCKED_RESOURCES = [
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*",
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    "*.mp4*", "*.webm*"
+]
+
+# -------- PRINT TO PDF (A4 SAFE SETTINGS) --------
+PDF_OPTIONS = {
+    "printBackground": True,
+    "preferCSSPageSize": False,
+    "paperWidth": 8.27,      # A4
+    "paperHeight": 11.69,    # A4
+    "marginTop": 0.4,
+    "marginBottom": 0.4,
+    "marginLeft": 0.4,
+    "marginRight": 0.4,
+    "scale": 0.9,
+    "transferMode": "ReturnAsStream",
+    "generateDocumentOutline": False,
+    "generateTaggedPDF": False
+}
+
+NETWORK_IDLE_TIMEOUT = 10
+SCROLL_TIMEOUT = 6
+SETTLE_QUIET = 0.5    # seconds without network activity that count as settled
+SETTLE_TIMEOUT = 5
+
+# Lazy-load trigger: keep scrolling while the page grows, one frame + 300 ms apart
+SCROLL_SCRIPT = """
+    const done = arguments[arguments.length - 1];
+    let last = 0, tries = 0;
+    const tick = () => {
+        window.scrollTo(0, document.body.scrollHeight);
+        requestAnimationFrame(() => {
+            const h = document.body.scrollHeight;
+            if (h === last || ++tries > 3) return done();
+            last = h;
+            setTimeout(tick, 300);
+        });
+    };
+    tick();
+"""
+
+PDF_DIR = "pdf_pages"
+os.makedirs(PDF_DIR, exist_ok=True)
+
+# -------- FIX TEXT OVERLAP --------
+# Adopted at document creation, so pages are laid out once with it
+# instead of being re-laid out after load
+PAGE_STYLE_SCRIPT = """
+    const sheet = new CSSStyleSheet();
+    sheet.replaceSync(`
+        * {
+            animation: none !important;
+            transition: none !important;
+        }
+        header, footer, nav, aside {
+            display: none !important;
+        }
+        * {
+            position: static !important;
+        }
+    `);
+    document.adoptedStyleSheets = [...document.adoptedStyleSheets, sheet];
+"""
+
+# -------------------- DRIVER POOL --------------------
+# One Chrome per worker thread, reused across pages
+thread_local = threading.local()
+drivers = []
+drivers_lock = threading.Lock()
+
+def get_driver():
+    driver = getattr(thread_local, "driver", None)
+    if driver is None:
+        driver = webdriver.Chrome(options=chrome_options)
+        thread_local.driver = driver
+        with drivers_lock:
+            drivers.append(driver)
+        try:
+            driver.set_script_timeout(SCROLL_TIMEOUT)
+            driver.execute_cdp_cmd("Page.setLifecycleEventsEnabled", {"enabled": True})
+            if args.text_only:
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_RESOURCES})
+
+            # Render with print stylesheets on a white page; applies to every navigation
+            driver.execute_cdp_cmd("Emulation.setEmulatedMedia", {"media": "print"})
+            driver.execute_cdp_cmd("Emulation.setDefaultBackgroundColorOverride", {
+                "color": {"r": 255, "g": 255, "b": 255, "a": 1}
+            })
+            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": PAGE_STYLE_SCRIPT})
+        except Exception:
+            drop_driver()
+            raise
+    return driver
+
+def drop_driver():
+    # Forget a dead session so the next page on this thread starts a new Chrome
+    driver = getattr(thread_local, "driver", None)
+    thread_local.driver = None
+    if driver is None:
+        return
+    with drivers_lock:
+        if driver in drivers:
+            drivers.remove(driver)
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def init_worker():
+    try:
+        get_driver()
+    except Exception as e:
+        logging.error(f"Failed to start Chrome: {e}")
+
+def quit_drivers():
+    with drivers_lock:
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        drivers.clear()
+
+atexit.register(quit_drivers)
+
+def wait_for_network_idle(driver, timeout=NETWORK_IDLE_TIMEOUT):
+    # Block until the top frame's current document fires networkIdle. The frame
+    # id survives navigations on a reused driver, so the loader id must match too
+    frame = driver.execute_cdp_cmd("Page.getFrameTree", {})["frameTree"]["frame"]
+    frame_id, loader_id = frame["id"], frame["loaderId"]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            params = message.get("params", {})
+            if (message.get("method") == "Page.lifecycleEvent"
+                    and params.get("name") == "networkIdle"
+                    and params.get("frameId") == frame_id
+                    and params.get("loaderId") == loader_id):
+                return True
+        time.sleep(0.1)
+    return False
+
+def wait_for_requests_settled(driver, quiet=SETTLE_QUIET, timeout=SETTLE_TIMEOUT):
+    # networkIdle fires once per navigation, so loads started by scrolling are
+    # tracked directly: wait until every request seen since the last log drain
+    # has finished and the network stayed quiet for `quiet` seconds
+    in_flight = set()
+    last_activity = time.monotonic()
+    deadline = last_activity + timeout
+    while time.monotonic() < deadline:
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            method = message.get("method")
+            request_id = message.get("params", {}).get("requestId")
+            if method == "Network.requestWillBeSent":
+                in_flight.add(request_id)
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                in_flight.discard(request_id)
+            else:
+                continue
+            last_activity = time.monotonic()
+        if not in_flight and time.monotonic() - last_activity >= quiet:
+            return True
+        time.sleep(0.1)
+    return False
+
+def save_pdf_stream(driver, handle, pdf_path, chunk_size=65536):
+    # Copy the CDP stream to disk in chunks instead of one base64 blob
+    try:
+        with open(pdf_path, "wb") as f:
+            while True:
+                chunk = driver.execute_cdp_cmd("IO.read", {"handle": handle, "size": chunk_size})
+                data = chunk.get("data", "")
+                if chunk.get("base64Encoded"):
+                    f.write(base64.b64decode(data))
+                else:
+                    f.write(data.encode("utf-8"))
+                if chunk.get("eof"):
+                    break
+    finally:
+        driver.execute_cdp_cmd("IO.close", {"handle": handle})
+
+# Boot Chrome in the workers while the homepage is fetched
+executor = ThreadPoolExecutor(max_workers=MAX_THREADS, initializer=init_worker)
+for _ in range(MAX_THREADS):
+    executor.submit(lambda: None)
 
 # -------------------- FETCH LINKS --------------------
 headers = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Chrome/120 Safari/537.36"
 }
 
+http_client = httpx.Client(
+    headers=headers,
+    timeout=15,
+    follow_redirects=True,
+    transport=httpx.HTTPTransport(http2=HTTP2, retries=3),
+)
+atexit.register(http_client.close)
+
+# Separate client for cache HEAD probes: short timeout, no retries
+probe_client = httpx.Client(headers=headers, timeout=3, follow_redirects=True)
+atexit.register(probe_client.close)
+
 logging.info(f"Base domain detected: {BASE_DOMAIN}")
 
 try:
-    response = requests.get(BASE_URL, headers=headers, timeout=15)
+    response = http_client.get(BASE_URL)
     response.raise_for_status()
 except Exception as e:
     logging.error(f"Failed to fetch site: {e}")
     exit(1)
 
-soup = BeautifulSoup(response.text, "html.parser")
-
-links = set()
-for a in soup.find_all("a", href=True):
-    full_url = clean_url(urljoin(BASE_URL, a["href"]))
-
-    if not full_url.startswith("http"):
-        continue
-    if not same_domain(full_url):
-        continue
-    if is_blocked_domain(full_url):
-        continue
+soup = BeautifulSoup(response.text, HTML_PARSER, parse_only=SoupStrainer("a", href=True))
 
-    links.add(full_url)
+links = {
+    full_url
+    for full_url in (clean_url(absolute_url(a["href"])) for a in soup.find_all("a", href=True))
+    if is_wanted_link(full_url)
+}
 
 if not links:
     logging.error("No valid internal links found")
@@ -93,122 +385,223 @@ if not links:
 links = sorted(links)
 logging.info(f"Total pages found: {len(links)}")
 
-# -------------------- SELENIUM SETUP --------------------
-chrome_options = Options()
-chrome_options.add_argument("--headless=new")
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--no-sandbox")
+# -------------------- PDF COMPRESSION --------------------
+def compress_pdf(pdf_path):
+    # Runs in the worker, so it overlaps with other workers' rendering
+    if pikepdf is None:
+        return
+    try:
+        with pikepdf.open(pdf_path, allow_overwriting_input=True) as pdf:
+            pdf.save(
+                pdf_path,
+                compress_streams=True,
+                stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                linearize=False,
+            )
+    except Exception as e:
+        logging.warning(f"Failed to compress {pdf_path}: {e}")
 
-PDF_DIR = "pdf_pages"
-os.makedirs(PDF_DIR, exist_ok=True)
+# -------------------- PDF CACHE --------------------
+CACHE_DIR = ".pdf_cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+def cache_key(link):
+    # Only pages with an ETag or Last-Modified can be safely reused
+    try:
+        head = probe_client.head(link)
+    except httpx.HTTPError:
+        return None
+    # Validators on error responses (404, 5xx) say nothing about the page
+    if not head.is_success:
+        return None
+    validator = head.headers.get("etag") or head.headers.get("last-modified")
+    if not validator:
+        return None
+    # Keyed on this script's render settings too: webscraper_api.py shares the
+    # cache directory but prints at CSS size without the injected styles
+    mode = "text-only" if args.text_only else "full"
+    settings = json.dumps(PDF_OPTIONS, sort_keys=True)
+    raw_key = f"webtext\n{link}\n{validator}\n{mode}\n{settings}\n{PAGE_STYLE_SCRIPT}"
+    return hashlib.sha256(raw_key.encode()).hexdigest()[:32]
+
+def store_in_cache(pdf_path, key):
+    cached_path = os.path.join(CACHE_DIR, f"{key}.pdf")
+    tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(pdf_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+    except OSError as e:
+        logging.warning(f"Failed to cache {pdf_path}: {e}")
 
 # -------------------- PAGE TO PDF --------------------
 def save_page_as_pdf(index, link):
     pdf_path = os.path.join(PDF_DIR, f"page_{index}.pdf")
-    driver = webdriver.Chrome(options=chrome_options)
+    driver = None
 
     try:
+        key = None if args.no_cache else cache_key(link)
+        if key:
+            cached_path = os.path.join(CACHE_DIR, f"{key}.pdf")
+            if os.path.exists(cached_path):
+                shutil.copyfile(cached_path, pdf_path)
+                logging.info(f"[{index}] Reused cached PDF")
+                return index, pdf_path
+
+        driver = get_driver()
         logging.info(f"[{index}] Opening: {link}")
+        driver.get_log("performance")  # discard events from the previous page
         driver.get(link)
 
         if is_blocked_domain(driver.current_url):
             logging.warning(f"[{index}] Redirected to blocked domain")
-            return None
+            return index, None
 
         WebDriverWait(driver, 15).until(
             EC.presence_of_element_located((By.TAG_NAME, "body"))
         )
 
-        # -------- FIX TEXT OVERLAP --------
-        driver.execute_script("""
-            document.body.style.zoom = '100%';
-
-            var style = document.createElement('style');
-            style.innerHTML = `
-                * {
-                    animation: none !important;
-                    transition: none !important;
-                }
-                header, footer, nav, aside {
-                    display: none !important;
-                }
-                * {
-                    position: static !important;
-                }
-            `;
-            document.head.appendChild(style);
-        """)
-
-        # Infinite scroll
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        while True:
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-
-        # -------- PRINT TO PDF (A4 SAFE SETTINGS) --------
-        pdf_data = driver.execute_cdp_cmd("Page.printToPDF", {
-            "printBackground": True,
-            "preferCSSPageSize": False,
-            "paperWidth": 8.27,      # A4
-            "paperHeight": 11.69,    # A4
-            "marginTop": 0.4,
-            "marginBottom": 0.4,
-            "marginLeft": 0.4,
-            "marginRight": 0.4,
-            "scale": 0.9,
-            "transferMode": "ReturnAsBase64"
-        })
+        # Let the initial load settle first
+        if not wait_for_network_idle(driver):
+            logging.warning(f"[{index}] Network not idle after {NETWORK_IDLE_TIMEOUT}s, continuing")
 
-        with open(pdf_path, "wb") as f:
-            f.write(base64.b64decode(pdf_data["data"]))
+        # Scroll to the bottom until the height settles (max 3 retries), then
+        # wait for the requests the scrolling started to finish
+        driver.get_log("performance")
+        try:
+            driver.execute_async_script(SCROLL_SCRIPT)
+        except TimeoutException:
+            logging.warning(f"[{index}] Scrolling timed out after {SCROLL_TIMEOUT}s, continuing")
+
+        if not wait_for_requests_settled(driver):
+            logging.warning(f"[{index}] Lazy-loaded requests still pending after {SETTLE_TIMEOUT}s, continuing")
+
+        # -------- PRINT TO PDF --------
+        pdf_data = driver.execute_cdp_cmd("Page.printToPDF", PDF_OPTIONS)
+
+        save_pdf_stream(driver, pdf_data["stream"], pdf_path)
+        compress_pdf(pdf_path)
+        if key:
+            store_in_cache(pdf_path, key)
 
         logging.info(f"[{index}] PDF saved successfully")
-        return pdf_path
+        return index, pdf_path
 
     except Exception as e:
         logging.error(f"[{index}] Failed: {e}")
-        return None
+        return index, None
 
     finally:
-        driver.quit()
+        # Leave the reused driver idle for the next page, or replace it
+        # if the session died (Chrome/chromedriver crash)
+        if driver is not None:
+            try:
+                driver.execute_script("window.stop();")
+            except WebDriverException as e:
+                logging.warning(f"[{index}] WebDriver session lost, restarting Chrome: {e.msg}")
+                drop_driver()
+
+# -------------------- ORDERED MERGER --------------------
+OUTPUT_PDF = "merged.pdf"
+
+def ordered_merger(results, status):
+    # Append finished pages in index order while later pages still render
+    writer = None
+    pending = {}
+    next_index = 1
+
+    while True:
+        item = results.get()
+        if item is None:
+            break
+        index, pdf = item
+        pending[index] = pdf
+
+        while next_index in pending:
+            pdf = pending.pop(next_index)
+            next_index += 1
+            if not pdf:
+                continue
+            try:
+                reader = PdfReader(pdf, strict=False)
+                if writer is None:
+                    # Clone the first document, copy only pages from the rest
+                    writer = PdfWriter(clone_from=reader)
+                else:
+                    writer.append_pages_from_reader(reader)
+                reader.stream.close()
+                del reader
+                status["merged"] += 1
+            except Exception:
+                logging.warning(f"Skipping corrupt PDF: {pdf}")
+
+    # Page files stay in PDF_DIR until the merged PDF is written
+    if writer is not None:
+        try:
+            writer.write(OUTPUT_PDF)
+            writer.close()
+        except Exception as e:
+            status["error"] = e
+
+def merge_with_qpdf(pdf_files):
+    # qpdf streams objects in C++; exit code 3 only signals warnings
+    result = subprocess.run(["qpdf", "--empty", "--pages", *pdf_files, "--", OUTPUT_PDF])
+    if result.returncode not in (0, 3):
+        raise subprocess.CalledProcessError(result.returncode, result.args)
+
+# With qpdf, merge once at the end; otherwise merge in the background
+USE_QPDF = shutil.which("qpdf") is not None
+merge_queue = queue.Queue()
+merge_status = {"merged": 0, "error": None}
+results = {}
+if not USE_QPDF:
+    merger = threading.Thread(target=ordered_merger, args=(merge_queue, merge_status), daemon=True)
+    merger.start()
 
 # -------------------- MULTITHREADING --------------------
-pdf_files = []
-
-with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+with executor:
     futures = [
         executor.submit(save_page_as_pdf, i + 1, link)
         for i, link in enumerate(links)
     ]
 
-    for future in futures:
-        result = future.result()
-        if result:
-            pdf_files.append(result)
+    # Collect (index, path) results as soon as they finish
+    for future in as_completed(futures):
+        index, pdf_path = future.result()
+        if USE_QPDF:
+            results[index] = pdf_path
+        else:
+            merge_queue.put((index, pdf_path))
 
-# -------------------- MERGE PDFs --------------------
-if not pdf_files:
-    logging.error("No PDFs generated")
-    exit(1)
+quit_drivers()
 
-pdf_files.sort(key=lambda x: int(os.path.basename(x).split("_")[1].split(".")[0]))
-
-writer = PdfWriter()
-for pdf in pdf_files:
+# -------------------- MERGE PDFs --------------------
+if USE_QPDF:
+    pdf_files = [results[i] for i in sorted(results) if results[i]]
     try:
-        writer.append(pdf)
-    except Exception:
-        logging.warning(f"Skipping corrupt PDF: {pdf}")
+        if pdf_files:
+            merge_with_qpdf(pdf_files)
+            merge_status["merged"] = len(pdf_files)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        logging.warning(f"qpdf failed ({e}), falling back to pypdf")
+        for i in sorted(results):
+            merge_queue.put((i, results[i]))
+        merge_queue.put(None)
+        ordered_merger(merge_queue, merge_status)
+else:
+    merge_queue.put(None)
+    merger.join()
+
+if merge_status["error"]:
+    logging.error(f"Failed to write merged PDF: {merge_status['error']}")
+    logging.error(f"Page PDFs kept in {PDF_DIR}")
+    exit(1)
 
-output_pdf = "merged.pdf"
-writer.write(output_pdf)
-writer.close()
+if not merge_status["merged"]:
+    logging.error("No PDFs generated")
+    exit(1)
 
-logging.info(f"Merged PDF created: {output_pdf}")
+logging.info(f"Merged PDF created: {OUTPUT_PDF}")
 
 # -------------------- CLEANUP --------------------
 shutil.rmtree(PDF_DIR, ignore_errors=True)